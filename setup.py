@@ -11,9 +11,13 @@ setup(
     py_modules=["target_kinesis"],
     install_requires=[
         "singer-python==5.4.1",
-        "boto3==1.9.36"
+        "boto3>=1.14",
+        "orjson>=3.6.0"
     ],
     extras_require={
+        'zstd': [
+            'zstandard'
+        ],
         'dev': [
             'pylint==2.1.1',
             'pytest==4.2.0',
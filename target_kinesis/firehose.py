@@ -1,20 +1,92 @@
+import functools
+import threading
+
 import boto3
-import json
+import orjson
+from botocore.config import Config
+
+try:
+    import zstandard as zstd
+except ImportError:
+    zstd = None
+
+from .kinesis import EMPTY_BATCH, SINGLE_RECORD, InvalidRecordBatch, split_batches
 
+# AWS limits for a single PutRecordBatch call and for one record's data
+# blob; the sizes checked are the delivered ones, so after compression
+MAX_BATCH_RECORDS = 500
+MAX_BATCH_BYTES = 4 * 1024 * 1024
+MAX_RECORD_BYTES = 1000 * 1024
 
+CLIENT_CONFIG = Config(
+    max_pool_connections=32,
+    retries={'max_attempts': 10, 'mode': 'adaptive'}
+)
+
+
+@functools.lru_cache(maxsize=1)
 def firehose_setup_client():
-    return boto3.client('firehose')
+    """Build the Firehose client once per process so every flush reuses
+    the same botocore session and keep-alive connection pool"""
+    return boto3.client('firehose', config=CLIENT_CONFIG)
+
 
+_zstd_local = threading.local()
 
-def firehose_deliver(client, stream_name, records):
 
-    if len(records) == 0:
-        raise Exception("Record list is empty")
+def zstd_compressor():
+    """One compressor context per uploader thread, reused across
+    batches; contexts are costly to allocate and not safe to share
+    between threads"""
+    if zstd is None:
+        raise Exception(
+            "compression 'zstd' requires the zstandard package")
+    compressor = getattr(_zstd_local, 'compressor', None)
+    if compressor is None:
+        compressor = zstd.ZstdCompressor(level=3)
+        _zstd_local.compressor = compressor
+    return compressor
+
+
+def _encode(record):
+    """The buffer hands records down pre-encoded; plain dicts from
+    direct callers are still serialized here"""
+    if isinstance(record, (bytes, bytearray)):
+        return record + b"\n"
+    return orjson.dumps(record) + b"\n"
+
+
+def firehose_deliver(client, stream_name, records, compression=None):
 
     if isinstance(records, dict):
-        raise Exception("Single record given, array is required")
+        raise SINGLE_RECORD
+
+    if not records:
+        raise EMPTY_BATCH
+
+    # newline-terminated so the records land in the delivery stream as
+    # newline-delimited JSON instead of concatenated objects
+    if compression == 'zstd':
+        # each record becomes its own zstd frame: frames concatenate
+        # into one decodable stream, but every frame costs ~13 header
+        # bytes and shares no dictionary with its neighbours, so the
+        # codec only pays off for reasonably large records
+        compress = zstd_compressor().compress
+        records = [{'Data': compress(_encode(r))} for r in records]
+    elif compression is not None:
+        raise Exception("Unsupported compression {}".format(compression))
+    else:
+        records = [{'Data': _encode(r)} for r in records]
 
-    records = list(map(lambda x: {'Data': json.dumps(x)}, records))
+    for entry in records:
+        if len(entry['Data']) > MAX_RECORD_BYTES:
+            raise InvalidRecordBatch(
+                "Record of {} bytes exceeds the 1000 KiB PutRecordBatch record limit".format(
+                    len(entry['Data'])))
 
-    response = client.put_record_batch(DeliveryStreamName=stream_name, Records=records)
+    # the buffer flushes on coarse thresholds and can overshoot by one
+    # record, so re-split here against the real API limits
+    response = None
+    for batch in split_batches(records, MAX_BATCH_RECORDS, MAX_BATCH_BYTES):
+        response = client.put_record_batch(DeliveryStreamName=stream_name, Records=batch)
     return response
@@ -1,23 +1,106 @@
+import functools
+import time
+
 import boto3
-import json
+import orjson
+from botocore.config import Config
+
+# AWS limits for a single PutRecords call
+MAX_BATCH_RECORDS = 500
+MAX_BATCH_BYTES = 5 * 1024 * 1024
+
+# AWS limit for one record: data blob plus partition key. An oversized
+# record would make its whole put_records call fail validation, so it
+# is rejected up front instead
+MAX_RECORD_BYTES = 1024 * 1024
+
+MAX_RETRIES = 3
+
 
+class InvalidRecordBatch(ValueError):
+    """Raised when a deliver function is handed something other than a
+    non-empty list of records"""
 
+
+# preallocated so the per-flush guards don't pay exception construction
+# and message formatting on every call
+EMPTY_BATCH = InvalidRecordBatch("Record list is empty")
+SINGLE_RECORD = InvalidRecordBatch("Single record given, array is required")
+
+CLIENT_CONFIG = Config(
+    max_pool_connections=32,
+    retries={'max_attempts': 10, 'mode': 'adaptive'}
+)
+
+
+@functools.lru_cache(maxsize=1)
 def kinesis_setup_client():
-    return boto3.client('kinesis')
+    """Build the Kinesis client once per process so every flush reuses
+    the same botocore session and keep-alive connection pool"""
+    return boto3.client('kinesis', config=CLIENT_CONFIG)
 
 
 def kinesis_deliver(client, stream_name, partition_key, records):
 
-    if len(records) == 0:
-        raise Exception("Record list is empty")
-
     if isinstance(records, dict):
-        raise Exception("Single record given, array is required")
-
-    for record in records:
-        response = client.put_record(
-            DeliveryStreamName=stream_name,
-            Record={'Data': json.dumps(record)},
-            PartitionKey=records[0][partition_key]
-        )
+        raise SINGLE_RECORD
+
+    if not records:
+        raise EMPTY_BATCH
+
+    # the buffer hands records down as (record, encoded) pairs; plain
+    # dicts from direct callers are still serialized here
+    entries = []
+    for r in records:
+        record, data = r if isinstance(r, tuple) else (r, orjson.dumps(r))
+        partition = str(record[partition_key])
+        if len(data) + len(partition) > MAX_RECORD_BYTES:
+            raise InvalidRecordBatch(
+                "Record of {} bytes exceeds the 1 MiB PutRecords record limit".format(
+                    len(data) + len(partition)))
+        entries.append({
+            'Data': data,
+            'PartitionKey': partition
+        })
+
+    response = None
+    for batch in split_batches(entries):
+        response = put_records_with_retry(client, stream_name, batch)
+    return response
+
+
+def split_batches(entries, max_records=MAX_BATCH_RECORDS, max_bytes=MAX_BATCH_BYTES):
+    """Split entries into batches below the put call API limits;
+    defaults match PutRecords, the Firehose path passes its own"""
+    batch = []
+    batch_bytes = 0
+    for entry in entries:
+        entry_bytes = len(entry['Data']) + len(entry.get('PartitionKey', ''))
+        if batch and (len(batch) >= max_records or batch_bytes + entry_bytes > max_bytes):
+            yield batch
+            batch = []
+            batch_bytes = 0
+        batch.append(entry)
+        batch_bytes += entry_bytes
+    if batch:
+        yield batch
+
+
+def put_records_with_retry(client, stream_name, entries):
+    """Send a single batch, retrying only the failed records with backoff"""
+    response = client.put_records(StreamName=stream_name, Records=entries)
+    attempt = 0
+    while response.get('FailedRecordCount', 0) > 0 and attempt < MAX_RETRIES:
+        time.sleep(2 ** attempt * 0.1)
+        entries = [
+            entry for entry, result in zip(entries, response['Records'])
+            if 'ErrorCode' in result
+        ]
+        response = client.put_records(StreamName=stream_name, Records=entries)
+        attempt += 1
+
+    if response.get('FailedRecordCount', 0) > 0:
+        raise Exception("{} records failed after {} retries".format(
+            response['FailedRecordCount'], MAX_RETRIES))
+
     return response
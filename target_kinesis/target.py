@@ -1,5 +1,4 @@
 import argparse
-import io
 import os
 import sys
 import json
@@ -8,10 +7,11 @@ import http.client
 import urllib
 import datetime
 import collections
-from decimal import Decimal
+import concurrent.futures
+from typing import Iterable
 
+import orjson
 import pkg_resources
-from jsonschema.validators import Draft4Validator
 import singer
 
 from .kinesis import *
@@ -19,12 +19,69 @@ from .firehose import *
 
 DEFAULT_RECORD_CHUNKS = 10
 DEFAULT_DATA_CHUNKS = 1000
+DEFAULT_UPLOAD_CONCURRENCY = 4
 
-logger = singer.get_logger()
-RECORDS = []
+# AWS ceilings for one put call, with a safety margin on the byte
+# limits to cover partition keys and request framing
+MAX_KINESIS_RECORDS = 500
+MAX_KINESIS_BYTES = 5 * 1024 * 1024 - 4096
+MAX_FIREHOSE_RECORDS = 500
+MAX_FIREHOSE_BYTES = 4 * 1024 * 1024 - 4096
 
+logger = singer.get_logger()
 
-def add_metadata_columns_to_schema(schema_message):
+# bound once; skips the module attribute lookup per record
+_dumps = orjson.dumps
+
+SDC_KEYS = frozenset((
+    '_sdc_batched_at',
+    '_sdc_deleted_at',
+    '_sdc_extracted_at',
+    '_sdc_primary_key',
+    '_sdc_received_at',
+    '_sdc_sequence',
+    '_sdc_table_version'
+))
+
+
+class RecordBuffer:
+    """Accumulates records between flushes, bucketed by stream, while
+    tracking the total count and serialized byte size incrementally
+    (+1 per record for the newline separator), so checking the flush
+    threshold is O(1) per line.
+
+    Bucketing keeps every delivered batch homogeneous: records from
+    different streams no longer share a single Kinesis batch whose
+    partition keys belong to whichever stream happened to be buffered
+    first.
+
+    Each entry is a (record, encoded) pair: serialization is
+    deterministic, so the bytes produced for the size counter are kept
+    and shipped as-is at flush time instead of re-encoding the dict"""
+
+    def __init__(self) -> None:
+        self._streams = collections.defaultdict(list)
+        self.n = 0
+        self.size = 0
+
+    def append(self, record: dict) -> None:
+        data = _dumps(record)
+        self._streams[record['stream']].append((record, data))
+        self.n += 1
+        self.size += len(data) + 1
+
+    def drain(self) -> list:
+        """Return the per-stream record lists and reset the buffer; the
+        buckets are handed off outright so in-flight uploads never share
+        state with subsequent appends"""
+        batches = [bucket for bucket in self._streams.values() if bucket]
+        self._streams = collections.defaultdict(list)
+        self.n = 0
+        self.size = 0
+        return batches
+
+
+def add_metadata_columns_to_schema(schema_message: dict) -> dict:
     """Metadata _sdc columns according to the stitch documentation at
     https://www.stitchdata.com/docs/data-structure/integration-schemas#sdc-columns
     Metadata columns gives information about data injections"""
@@ -41,188 +98,199 @@ def add_metadata_columns_to_schema(schema_message):
     return schema_message
 
 
-def add_metadata_values_to_record(record_message, schema_message, timestamp):
+def add_metadata_values_to_record(record_message: dict, key_properties, utcnow_iso: str, sdc_sequence: int) -> dict:
     """Populate metadata _sdc columns from incoming record message
-    The location of the required attributes are fixed in the stream"""
-    utcnow = timestamp.astimezone(datetime.timezone.utc).replace(tzinfo=None).isoformat()
-    record_message['record'].update(
-        _sdc_batched_at=utcnow,
-        _sdc_deleted_at=record_message.get('record', {}).get('_sdc_deleted_at'),
-        _sdc_extracted_at=record_message.get('time_extracted'),
-        _sdc_primary_key=schema_message.get('key_properties'),
-        _sdc_received_at=utcnow,
-        _sdc_sequence=int(timestamp.timestamp() * 1e3),
-        _sdc_table_version=record_message.get('version'))
-
-    return record_message['record']
-
-
-def remove_metadata_values_from_record(record_message):
+    The location of the required attributes are fixed in the stream.
+    The timestamp values are precomputed once per batch by the caller
+    and the record dict is mutated in place, allocation free"""
+    record = record_message['record']
+    record['_sdc_batched_at'] = utcnow_iso
+    record['_sdc_deleted_at'] = record.get('_sdc_deleted_at')
+    record['_sdc_extracted_at'] = record_message.get('time_extracted')
+    record['_sdc_primary_key'] = key_properties
+    record['_sdc_received_at'] = utcnow_iso
+    record['_sdc_sequence'] = sdc_sequence
+    record['_sdc_table_version'] = record_message.get('version')
+
+    return record
+
+
+def remove_metadata_values_from_record(record_message: dict) -> dict:
     """Removes every metadata _sdc column from a given record message"""
-    for key in {
-        '_sdc_batched_at',
-        '_sdc_deleted_at',
-        '_sdc_extracted_at',
-        '_sdc_primary_key',
-        '_sdc_received_at',
-        '_sdc_sequence',
-        '_sdc_table_version'
-    }:
-
-        record_message['record'].pop(key, None)
+    record = record_message['record']
+    if not SDC_KEYS.isdisjoint(record):
+        record = {k: v for k, v in record.items() if k not in SDC_KEYS}
+        record_message['record'] = record
 
-    return record_message['record']
+    return record
 
 
 def emit_state(state):
     if state is not None:
-        line = json.dumps(state)
+        line = orjson.dumps(state).decode()
         logger.debug('Emitting state {}'.format(line))
         sys.stdout.write("{}\n".format(line))
         sys.stdout.flush()
 
 
-def float_to_decimal(value):
-    if isinstance(value, float):
-        return Decimal(str(value))
-    if isinstance(value, list):
-        return [float_to_decimal(child) for child in value]
-    if isinstance(value, dict):
-        return {k: float_to_decimal(v) for k, v in value.items()}
-    return value
-
-
-def decode_line(line):
+def decode_line(line) -> dict:
     try:
-        o = json.loads(line)
-    except json.decoder.JSONDecodeError:
+        o = orjson.loads(line)
+    except orjson.JSONDecodeError:
         logger.error("Unable to parse:\n{}".format(line))
         raise
     return o
 
 
-def get_line_type(decode_line, line):
+def get_line_type(decode_line: dict, line) -> str:
     if 'type' not in decode_line:
         raise Exception(
             "Line is missing required key 'type': {}".format(line))
     return decode_line['type']
 
 
-def handle_record(o, schemas, line, config, validators, ts):
+def handle_record(o: dict, schemas: dict, key_properties: dict, line, config: dict, buf: RecordBuffer, utcnow_iso: str, sdc_sequence: int) -> None:
     if 'stream' not in o:
         raise Exception(
             "Line is missing required key 'stream': {}".format(line))
     if o['stream'] not in schemas:
         raise Exception(
             "A record for stream {} was encountered before a corresponding schema".format(o['stream']))
-    validate_record(o['stream'], o['record'], schemas, validators)
 
     if config.get('add_metadata_columns'):
-        o['record'] = add_metadata_values_to_record(o, {}, ts)
+        o['record'] = add_metadata_values_to_record(
+            o, key_properties.get(o['stream']), utcnow_iso, sdc_sequence)
     else:
         o['record'] = remove_metadata_values_from_record(o)
 
     o['record']['stream'] = o['stream']
-    buffer_record(o['record'])
+    buf.append(o['record'])
 
 
-def handle_state(o):
+def handle_state(o: dict):
     logger.debug('Setting state to {}'.format(o['value']))
     return o['value']
 
 
-def handle_schema(o, schemas, validators, key_properties, line, config):
+def handle_schema(o: dict, schemas: dict, key_properties: dict, line, config: dict) -> tuple:
     if 'stream' not in o:
         raise Exception(
             "Line is missing required key 'stream': {}".format(line))
     stream = o['stream']
 
     if config.get('add_metadata_columns'):
-        schemas[stream] = add_metadata_columns_to_schema(o)
-    else:
-        schemas[stream] = float_to_decimal(o['schema'])
+        add_metadata_columns_to_schema(o)
 
     schemas[stream] = o['schema']
-    validators[stream] = Draft4Validator(o['schema'])
     if 'key_properties' not in o:
         raise Exception("key_properties field is required")
     key_properties[stream] = o['key_properties']
 
-
-    return schemas, validators, key_properties
+    return schemas, key_properties
 
 
-def persist_lines(config, lines):
-
-    global RECORDS
-    RECORDS = []
+def persist_lines(config: dict, lines: Iterable):
 
     state = None
     schemas = {}
     key_properties = {}
-    validators = {}
 
     lines_counter = 0
 
-    timezone = datetime.timezone(datetime.timedelta(hours=config.get('timezone_offset'))) if config.get('timezone_offset') is not None else None
-    now = datetime.datetime.now(timezone)
-
-    for line in lines:
-        lines_counter += 1
-
-        # default to smallest between 10 records or 1kB
-        record_chunks = config["record_chunks"] if "record_chunks" in config else DEFAULT_RECORD_CHUNKS
-        data_chunks = config["data_chunks"] if "data_chunks" in config else DEFAULT_DATA_CHUNKS
-
-        o = decode_line(line)
-        t = get_line_type(o, line)
-
-        if t == 'RECORD':
-            handle_record(o, schemas, line, config, validators, now)
-            state = None
-        elif t == 'STATE':
-            state = handle_state(o)
-        elif t == 'SCHEMA':
-            handle_schema(o, schemas, validators, key_properties, line, config)
-        else:
-            raise Exception(
-                "Unknown message type {} in message {}".format(o['type'], o))
+    # default to smallest between 10 records or 1kB
+    record_chunks = config["record_chunks"] if "record_chunks" in config else DEFAULT_RECORD_CHUNKS
+    data_chunks = config["data_chunks"] if "data_chunks" in config else DEFAULT_DATA_CHUNKS
 
-        enough_records = len(RECORDS) > record_chunks
-
-        # approximate message size is calculated using stringified
-        # version of the array. This is the faster way to get the 
-        # approximated size of the data but require a +3 to skip the 
-        # "empty array" special case
-        enough_data = len(str(RECORDS)) > (data_chunks + 3) 
-
-        if enough_records or enough_data:
-            deliver_records(config, RECORDS)
-            RECORDS = []
+    # honor the configured thresholds but never let a batch cross the
+    # payload limits of the selected service
+    if config.get("is_firehose", False):
+        max_records = min(record_chunks, MAX_FIREHOSE_RECORDS)
+        max_bytes = min(data_chunks, MAX_FIREHOSE_BYTES)
+    else:
+        max_records = min(record_chunks, MAX_KINESIS_RECORDS)
+        max_bytes = min(data_chunks, MAX_KINESIS_BYTES)
 
-    # deliver pending records after last line
-    if len(RECORDS) > 0:
-        deliver_records(config, RECORDS)
+    timezone = datetime.timezone(datetime.timedelta(hours=config.get('timezone_offset'))) if config.get('timezone_offset') is not None else None
+    now = datetime.datetime.now(timezone)
+    utcnow_iso = now.astimezone(datetime.timezone.utc).replace(tzinfo=None).isoformat()
+    sdc_sequence = int(now.timestamp() * 1e3)
+
+    buf = RecordBuffer()
+
+    def on_record(o, line):
+        nonlocal state
+        handle_record(o, schemas, key_properties, line, config, buf, utcnow_iso, sdc_sequence)
+        state = None
+
+    def on_state(o, line):
+        nonlocal state
+        state = handle_state(o)
+
+    def on_schema(o, line):
+        handle_schema(o, schemas, key_properties, line, config)
+
+    handlers = {'RECORD': on_record, 'STATE': on_state, 'SCHEMA': on_schema}
+
+    upload_concurrency = config.get("upload_concurrency", DEFAULT_UPLOAD_CONCURRENCY)
+    pending = collections.deque()
+
+    def flush(executor):
+        for batch in buf.drain():
+            pending.append(executor.submit(deliver_records, config, batch))
+        # bound the number of in-flight batches so parsing cannot run
+        # arbitrarily far ahead of slow uploads
+        while len(pending) > upload_concurrency * 2:
+            pending.popleft().result()
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=upload_concurrency) as executor:
+        for line in lines:
+            lines_counter += 1
+
+            # decode_line/get_line_type inlined: two fewer Python frames
+            # per input line
+            try:
+                o = orjson.loads(line)
+            except orjson.JSONDecodeError:
+                logger.error("Unable to parse:\n{}".format(line))
+                raise
+
+            t = o.get('type')
+            handler = handlers.get(t)
+            if handler is None:
+                if t is None:
+                    raise Exception(
+                        "Line is missing required key 'type': {}".format(line))
+                raise Exception(
+                    "Unknown message type {} in message {}".format(t, o))
+            handler(o, line)
+
+            enough_records = buf.n >= max_records
+            enough_data = buf.size >= max_bytes
+
+            if enough_records or enough_data:
+                flush(executor)
+
+        # deliver pending records after last line
+        if buf.n > 0:
+            flush(executor)
+
+        # surface any delivery failure from the uploader threads
+        for future in pending:
+            future.result()
 
     return state
 
 
-def validate_record(stream, record, schemas, validators):
-    pass
-    # schema = schemas[stream]
-    # validators[stream].validate(record)
-
-
-def buffer_record(record):
-    RECORDS.append(record)
-
-
-def deliver_records(config, records):
+def deliver_records(config: dict, records: list) -> None:
+    """Ship one drained buffer bucket of (record, encoded) pairs.
+    Firehose only needs the encoded bytes; Kinesis also draws the
+    partition key from each record dict"""
     is_firehose = config.get("is_firehose", False)
     if is_firehose:
         client = firehose_setup_client()
         stream_name = config.get("stream_name", "missing-stream-name")
-        firehose_deliver(client, stream_name, records)
+        firehose_deliver(client, stream_name, [data for _, data in records],
+                         config.get("compression"))
     else:
         client = kinesis_setup_client()
         stream_name = config.get("stream_name", "missing-stream-name")
@@ -246,7 +314,9 @@ def main():
 
     config = load_config(args.config)
 
-    input = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8')
+    # read raw byte lines: orjson.loads accepts bytes directly, so the
+    # TextIOWrapper UTF-8 decode pass over the whole input is skipped
+    input = sys.stdin.buffer
     state = persist_lines(config, input)
     emit_state(state)
 
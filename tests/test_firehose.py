@@ -1,6 +1,7 @@
 from target_kinesis.firehose import *
 
 import boto3
+import pytest
 from moto import mock_kinesis
 
 FAKE_STREAM_NAME = "test-stream"
@@ -94,3 +95,78 @@ def test_setup_client_firehose():
     config = {}
     client = firehose_setup_client()
     assert client.__class__.__name__ == "Firehose"
+
+
+# batch splitting
+
+
+def test_deliver_splits_past_record_limit(mocker):
+    client = mocker.Mock()
+    data = [{"example": "content"}] * (MAX_BATCH_RECORDS + 1)
+
+    firehose_deliver(client, FAKE_STREAM_NAME, data)
+
+    batches = [call[1]['Records']
+               for call in client.put_record_batch.call_args_list]
+    assert [len(batch) for batch in batches] == [MAX_BATCH_RECORDS, 1]
+
+
+def test_deliver_splits_at_byte_limit(mocker):
+    client = mocker.Mock()
+    data = [{"blob": "x" * (MAX_RECORD_BYTES - 100)}] * 5
+
+    firehose_deliver(client, FAKE_STREAM_NAME, data)
+
+    batches = [call[1]['Records']
+               for call in client.put_record_batch.call_args_list]
+    assert [len(batch) for batch in batches] == [4, 1]
+    for batch in batches:
+        assert sum(len(record['Data']) for record in batch) <= MAX_BATCH_BYTES
+
+
+def test_deliver_raise_on_oversized_record(mocker):
+    client = mocker.Mock()
+    data = [{"blob": "x" * MAX_RECORD_BYTES}]
+
+    with pytest.raises(InvalidRecordBatch):
+        firehose_deliver(client, FAKE_STREAM_NAME, data)
+    client.put_record_batch.assert_not_called()
+
+
+# compression
+
+
+def test_deliver_zstd_round_trip(mocker):
+    zstandard = pytest.importorskip("zstandard")
+    client = mocker.Mock()
+    data = [
+        {"example": "content1"},
+        {"example": "content2"}
+    ]
+
+    firehose_deliver(client, FAKE_STREAM_NAME, data, compression="zstd")
+
+    records = client.put_record_batch.call_args[1]['Records']
+    payload = b"".join(
+        zstandard.ZstdDecompressor().decompress(record['Data'])
+        for record in records)
+    assert payload == b'{"example":"content1"}\n{"example":"content2"}\n'
+
+
+def test_deliver_zstd_raise_without_package(mocker):
+    client = mocker.Mock()
+    mocker.patch('target_kinesis.firehose.zstd', None)
+
+    with pytest.raises(Exception, match="zstandard"):
+        firehose_deliver(client, FAKE_STREAM_NAME,
+                         [{"example": "content"}], compression="zstd")
+    client.put_record_batch.assert_not_called()
+
+
+def test_deliver_raise_on_unsupported_compression(mocker):
+    client = mocker.Mock()
+
+    with pytest.raises(Exception, match="Unsupported compression"):
+        firehose_deliver(client, FAKE_STREAM_NAME,
+                         [{"example": "content"}], compression="lz4")
+    client.put_record_batch.assert_not_called()
@@ -1,6 +1,7 @@
 from target_kinesis.kinesis import *
 
 import boto3
+import pytest
 from moto import mock_kinesis
 
 FAKE_STREAM_NAME = "test-stream"
@@ -15,19 +16,27 @@ def create_stream(client, stream_name):
     client.create_stream(StreamName=stream_name, ShardCount=1)
 
 
+class FakePutRecordsClient:
+    """Returns scripted put_records responses and records each call"""
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = []
+
+    def put_records(self, StreamName, Records):
+        self.calls.append(Records)
+        return self.responses.pop(0)
+
+
 @mock_kinesis
 def test_deliver_single_record_dict():
     client = setup_connection()
     create_stream(client, FAKE_STREAM_NAME)
 
-    data = [{"id": "1", "example": "content"}]
+    data = {"id": "1", "example": "content"}
 
-    try:
-        response = kinesis_deliver(
-            client, FAKE_STREAM_NAME, PARTITION_KEY, data)
-        assert False
-    except Exception:
-        assert True
+    with pytest.raises(InvalidRecordBatch):
+        kinesis_deliver(client, FAKE_STREAM_NAME, PARTITION_KEY, data)
 
 
 @mock_kinesis
@@ -99,6 +108,89 @@ def test_deliver_raise_on_nonexistent_stream():
 
 @mock_kinesis
 def test_setup_client_kinesis():
-    config = {}
-    client = kinesis_setup_client(config)
+    client = kinesis_setup_client()
     assert client.__class__.__name__ == "Kinesis"
+
+
+def test_deliver_raise_on_oversized_record(mocker):
+    client = mocker.Mock()
+
+    data = [{"id": "1", "blob": "x" * MAX_RECORD_BYTES}]
+
+    with pytest.raises(InvalidRecordBatch):
+        kinesis_deliver(client, FAKE_STREAM_NAME, PARTITION_KEY, data)
+    client.put_records.assert_not_called()
+
+
+# split_batches
+
+
+def test_split_batches_empty():
+    assert list(split_batches([])) == []
+
+
+def test_split_batches_single_batch_at_record_limit():
+    entries = [{'Data': b'x', 'PartitionKey': '1'}] * MAX_BATCH_RECORDS
+    batches = list(split_batches(entries))
+    assert len(batches) == 1
+    assert len(batches[0]) == MAX_BATCH_RECORDS
+
+
+def test_split_batches_splits_past_record_limit():
+    entries = [{'Data': b'x', 'PartitionKey': '1'}] * (MAX_BATCH_RECORDS + 1)
+    batches = list(split_batches(entries))
+    assert [len(batch) for batch in batches] == [MAX_BATCH_RECORDS, 1]
+    assert batches[0] + batches[1] == entries
+
+
+def test_split_batches_splits_at_byte_limit():
+    data = b'x' * (MAX_BATCH_BYTES // 2 - 100)
+    entries = [{'Data': data, 'PartitionKey': '1'}] * 3
+    batches = list(split_batches(entries))
+    assert [len(batch) for batch in batches] == [2, 1]
+
+
+# put_records_with_retry
+
+
+def test_put_records_with_retry_first_attempt_ok():
+    response = {'FailedRecordCount': 0, 'Records': [{'SequenceNumber': '1'}]}
+    client = FakePutRecordsClient([response])
+    entries = [{'Data': b'a', 'PartitionKey': '1'}]
+
+    assert put_records_with_retry(client, FAKE_STREAM_NAME, entries) is response
+    assert len(client.calls) == 1
+
+
+def test_put_records_with_retry_resends_only_failed_records(mocker):
+    mocker.patch('time.sleep')
+    entries = [
+        {'Data': b'a', 'PartitionKey': '1'},
+        {'Data': b'b', 'PartitionKey': '2'},
+        {'Data': b'c', 'PartitionKey': '3'},
+    ]
+    client = FakePutRecordsClient([
+        {'FailedRecordCount': 1, 'Records': [
+            {'SequenceNumber': '1'},
+            {'ErrorCode': 'ProvisionedThroughputExceededException'},
+            {'SequenceNumber': '3'},
+        ]},
+        {'FailedRecordCount': 0, 'Records': [{'SequenceNumber': '2'}]},
+    ])
+
+    response = put_records_with_retry(client, FAKE_STREAM_NAME, entries)
+    assert response['FailedRecordCount'] == 0
+    assert client.calls[0] == entries
+    assert client.calls[1] == [entries[1]]
+
+
+def test_put_records_with_retry_raises_after_max_retries(mocker):
+    mocker.patch('time.sleep')
+    failed = {'FailedRecordCount': 1,
+              'Records': [{'ErrorCode': 'InternalFailure'}]}
+    client = FakePutRecordsClient([failed] * (MAX_RETRIES + 1))
+    entries = [{'Data': b'a', 'PartitionKey': '1'}]
+
+    with pytest.raises(Exception, match="failed after"):
+        put_records_with_retry(client, FAKE_STREAM_NAME, entries)
+    assert len(client.calls) == MAX_RETRIES + 1
@@ -1,7 +1,8 @@
 import json
+import pytest
 from target_kinesis.target import *
 from mock import mock_open
-from io import StringIO
+from io import BytesIO
 
 # emit_state
 
@@ -56,28 +57,25 @@ def test_get_line_type_missing():
 
 
 def test_handle_record(mocker):
-    mocker.patch('target_kinesis.target.validate_record')
     mocker.patch('target_kinesis.target.deliver_records')
-    result = handle_record({"stream": "a", "record": "b"}, {
-                           "a": {"field": "value"}}, "", {}, {})
+    result = handle_record({"stream": "a", "record": {}}, {
+                           "a": {"field": "value"}}, {}, "", {}, RecordBuffer(), "", 0)
     assert result is None
 
 
 def test_handle_record_fail_on_missing_stream_name(mocker):
-    mocker.patch('target_kinesis.target.validate_record')
     mocker.patch('target_kinesis.target.deliver_records')
     try:
-        handle_record({"record": "b"}, {}, "", {}, {})
+        handle_record({"record": {}}, {}, {}, "", {}, RecordBuffer(), "", 0)
         assert False
     except Exception:
         assert True
 
 
 def test_handle_record_fail_on_missing_schema(mocker):
-    mocker.patch('target_kinesis.target.validate_record')
     mocker.patch('target_kinesis.target.deliver_records')
     try:
-        handle_record({"stream": "a", "record": "b"}, {}, "", {}, {})
+        handle_record({"stream": "a", "record": {}}, {}, {}, "", {}, RecordBuffer(), "", 0)
         assert False
     except Exception:
         assert True
@@ -95,31 +93,28 @@ def test_handle_state():
 # handle_schema
 
 
-def test_handle_schema_returns_values(mocker):
-    mocker.patch('jsonschema.validators.Draft4Validator')
+def test_handle_schema_returns_values():
     sample_schema = {"stream": "stream-name",
                      "schema": {}, "key_properties": ["id"]}
-    schemas, validators, key_properties = handle_schema(
-        sample_schema, {}, {}, {}, "")
+    schemas, key_properties = handle_schema(
+        sample_schema, {}, {}, "", {})
     assert "stream-name" in schemas
     assert "stream-name" in key_properties
-    assert "stream-name" in validators
 
 
 def test_handle_schema_fail_missing_stream():
     sample_schema = {"value": "1", "limit": "50"}
     try:
-        handle_schema(sample_schema, {}, {}, {}, "")
+        handle_schema(sample_schema, {}, {}, "", {})
         assert False
     except Exception:
         assert True
 
 
-def test_handle_schema_fail_missing_key_properties(mocker):
-    mocker.patch('jsonschema.validators.Draft4Validator')
+def test_handle_schema_fail_missing_key_properties():
     sample_schema = {"stream": "stream-name", "schema": {}}
     try:
-        handle_schema(sample_schema, {}, {}, {}, "")
+        handle_schema(sample_schema, {}, {}, "", {})
         assert False
     except Exception:
         assert True
@@ -171,14 +166,6 @@ def test_load_config_from_file(mocker):
     mocked_open.assert_called_with(config_path)
 
 
-# validate_record
-
-
-def test_validate_record_empty_filename():
-    validate_record("", {}, {}, {})
-    assert True
-
-
 # persist_lines
 
 
@@ -196,6 +183,33 @@ def test_persist_lines_fail_unknown_type():
         assert True
 
 
+def test_persist_lines_raises_delivery_failure(mocker):
+    # a failure inside an uploader thread must surface to the caller,
+    # not die silently with the future
+    mocker.patch('target_kinesis.target.deliver_records',
+                 side_effect=Exception("delivery failed"))
+    lines = ['{"type": "SCHEMA", "stream": "example", "schema": {}, "key_properties": ["id"]}',
+             '{"type": "RECORD", "stream": "example", "record": {"id": "1"}}']
+    with pytest.raises(Exception, match="delivery failed"):
+        persist_lines({"record_chunks": 1, "data_chunks": 100000}, lines)
+
+
+def test_persist_lines_flush_at_max_records(mocker):
+    mocked_deliver = mocker.patch('target_kinesis.target.deliver_records')
+    lines = ['{"type": "SCHEMA", "stream": "example", "schema": {}, "key_properties": ["id"]}']
+    lines += ['{"type": "RECORD", "stream": "example", "record": {"id": "1"}}'] * 4
+    persist_lines({"record_chunks": 2, "data_chunks": 100000}, lines)
+    assert mocked_deliver.call_count == 2
+
+
+def test_persist_lines_flush_at_max_bytes(mocker):
+    mocked_deliver = mocker.patch('target_kinesis.target.deliver_records')
+    lines = ['{"type": "SCHEMA", "stream": "example", "schema": {}, "key_properties": ["id"]}']
+    lines += ['{"type": "RECORD", "stream": "example", "record": {"id": "1"}}'] * 3
+    persist_lines({"record_chunks": 100, "data_chunks": 1}, lines)
+    assert mocked_deliver.call_count == 3
+
+
 def test_persist_lines_with_record(mocker):
     records = ['{"type": "RECORD"}']
     mocked_record = mocker.patch('target_kinesis.target.handle_record')
@@ -249,8 +263,8 @@ def test_persist_lines_with_multiple_records(mocker):
 def test_main(mocker, monkeypatch):
     mocker.patch('argparse.ArgumentParser.parse_args',
                  return_value=argparse.Namespace(config=""))
-    mocker.patch('io.TextIOWrapper',
-                 return_value='{"type": "RECORD"}\n{"type": "RECORD"}\n')
+    mocker.patch('sys.stdin', mocker.Mock(
+        buffer=BytesIO(b'{"type": "RECORD"}\n{"type": "RECORD"}\n')))
     mocker.patch('target_kinesis.target.load_config')
     mocker.patch('target_kinesis.target.persist_lines')
     mocker.patch('target_kinesis.target.emit_state')
@@ -260,8 +274,7 @@ def test_main(mocker, monkeypatch):
 def test_main_with_firehose(mocker):
     # Mock standard input
     input = '{"type": "SCHEMA", "stream": "example", "schema": {}, "key_properties": ["id"]}\n{"type": "RECORD", "stream": "example", "record": {"id": "1"}}'
-    mocker.patch('io.TextIOWrapper',
-                 return_value=StringIO(input))
+    mocker.patch('sys.stdin', mocker.Mock(buffer=BytesIO(input.encode())))
 
     # Mock configuration file
     mocker.patch('argparse.ArgumentParser.parse_args',
@@ -281,8 +294,7 @@ def test_main_with_firehose(mocker):
 def test_main_with_kinesis(mocker):
     # Mock standard input
     input = '{"type": "SCHEMA", "stream": "example", "schema": {}, "key_properties": ["id"]}\n{"type": "RECORD", "stream": "example", "record": {"id": "1"}}'
-    mocker.patch('io.TextIOWrapper',
-                 return_value=StringIO(input))
+    mocker.patch('sys.stdin', mocker.Mock(buffer=BytesIO(input.encode())))
 
     # Mock configuration file
     mocker.patch('argparse.ArgumentParser.parse_args',
@@ -302,8 +314,7 @@ def test_main_with_kinesis(mocker):
 def test_main_deliver_last_records(mocker):
     # Mock standard input
     input = '{"type": "SCHEMA", "stream": "example", "schema": {}, "key_properties": ["id"]}\n{"type": "RECORD", "stream": "example", "record": {"id": "1"}}'
-    mocker.patch('io.TextIOWrapper',
-                 return_value=StringIO(input))
+    mocker.patch('sys.stdin', mocker.Mock(buffer=BytesIO(input.encode())))
 
     # Mock configuration file
     mocker.patch('argparse.ArgumentParser.parse_args',